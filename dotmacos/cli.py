@@ -1,118 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
 from pathlib import Path
-from string import Template
 import subprocess
 import sys
-from typing import FrozenSet, List
-
-import click
-import click_completion
+import textwrap
+from typing import (Any, Callable, Dict, FrozenSet, Iterator, List, Optional,
+                    TypeVar)
 
 from .preflib import FileFormat, Sections
 
 
-MAN_PATH = Path(__file__).parent / "man.txt"
 CONFIG_FORMATS: FrozenSet[str] = frozenset(FileFormat.__members__.keys())
+FILE_FORMATS: Dict[str, FileFormat] = {name: FileFormat[name]
+                                       for name in CONFIG_FORMATS}
+T = TypeVar("T")
+# Set by the shell when completing a dotmacos command line.
+COMPLETION_ENV_VAR = "_DOTMACOS_COMPLETE"
+STDOUT_IS_TTY = sys.stdout.isatty()
+STDERR_IS_TTY = sys.stderr.isatty()
+ERROR_MARKER = b"\033[31mE\033[0m " if STDERR_IS_TTY else b"E "
+INFO_MARKER = b"  "
+
+
+# Options of the commands handled by parse_args, mapped to keyword arguments.
+FAST_COMMAND_FLAGS: Dict[str, Dict[str, str]] = {
+    "set": {"--no-restart-apps": "no_restart_apps", "--dry-run": "dry_run"},
+    "get": {"--all-keys": "all_keys", "--dry-run": "dry_run"},
+}
 
 
-# Initialize shell completion support.
-click_completion.init()
+@functools.lru_cache(maxsize = 1)
+def get_man_path() -> Path:
+    """Path of the manual, resolved on first use rather than at import."""
+    return Path(__file__).parent / "man.txt"
 
 
-@click.command()
-def help() -> None:
+def show_manual() -> None:
     """Show the manual."""
-    if not MAN_PATH.exists():
-        raise Exception("Documentation ({}) not found.".format(MAN_PATH.name))
-    with open(MAN_PATH.as_posix(), "rt") as man_file:
-        man_template = Template(man_file.read())
-    if sys.stdout.isatty():
-        man_text = man_template.safe_substitute(bold = "\033[1m",
-                                                reset = "\033[0m")
-        subprocess.run(["less", "-R"], input = man_text.encode())
+    try:
+        # Generated from man.txt when the package is built.
+        from ._man_data import MAN_TEXT as man_text
+    except ImportError:
+        man_path = get_man_path()
+        if not man_path.is_file():
+            raise Exception(
+                "Documentation ({}) not found.".format(man_path.name))
+        man_text = man_path.read_text()
+    if STDOUT_IS_TTY:
+        pager = subprocess.Popen(["less", "-R"], stdin = subprocess.PIPE,
+                                 universal_newlines = True)
+        pager.communicate(man_text
+                          .replace("${bold}", "\033[1m")
+                          .replace("${reset}", "\033[0m"))
     else:
-        man_text = man_template.safe_substitute(bold = "", reset = "")
-        print(man_text)
-
-
-@click.command()
-@click.option("--format", type = click.Choice(CONFIG_FORMATS), required = True,
-              help = "Format of config files.")
-@click.option("--no-restart-apps", is_flag = True,
-              help = "Skip restarting affected applications. New preferences "
-                     "may not take effect.")
-@click.option("--dry-run", is_flag = True,
-              help = "Show what settings would be added or changed.")
-@click.argument("config_paths", type = Path, nargs = -1)
-def set(format: str, no_restart_apps: bool, dry_run: bool,
-        config_paths: List[Path]) -> None:
-    """Set OS and app preferences from config files. Restart affected
-    applications to ensure that new preferences take effect immediately."""
+        print(man_text.replace("${bold}", "").replace("${reset}", ""))
+
+
+def set_prefs(format: str, no_restart_apps: bool, dry_run: bool,
+              config_paths: List[Path]) -> None:
+    """Set OS and app preferences from config files."""
     if len(config_paths) == 0:
         raise ValueError("Specify one or more config files.")
-    file_format = FileFormat[format]
-    for config_path in config_paths:
-        if dry_run:
-            diff_text = (
-                Sections
-                .from_config_file(path = config_path, file_format = file_format)
-                .diff_with_os(os_is_base = True))
-            if len(diff_text) > 0:
-                print("\n" + config_path.as_posix() + ":")
-                print("  " + diff_text.replace("\n", "\n  "))
-        else:
-            (Sections
-             .from_config_file(path = config_path, file_format = file_format)
-             .merge_to_os())
-
-
-@click.command()
-@click.option("--format", type = click.Choice(CONFIG_FORMATS), required = True,
-              help = "Format of config files.")
-@click.option("--all-keys", is_flag = True,
-              help = "Include keys not in the config files.")
-@click.option("--dry-run", is_flag = True,
-              help = "Show what settings would be added or changed.")
-@click.argument("config_paths", type = Path, nargs = -1)
-def get(format: str, all_keys: bool, dry_run: bool, config_paths: List[Path],
-        ) -> None:
-    """Get OS and app preferences, writing them to existing config files. Only
-    keys in the config files are written, unless all_keys is True. Values are
-    merged, with retrieved preferences taking precedence."""
+    file_format = FILE_FORMATS[format]
+    if dry_run:
+
+        def diff_config(config_path: Path) -> Optional[str]:
+            return (load_config(config_path, file_format)
+                    .diff_with_os(os_is_base = True))
+
+        for config_path, diff_text in zip(
+                config_paths, map_config_paths(diff_config, config_paths)):
+            print_diff(config_path, diff_text)
+    else:
+        # Config files may set the same domain, so they are applied serially.
+        for config_path in config_paths:
+            load_config(config_path, file_format).merge_to_os()
+
+
+def get_prefs(format: str, all_keys: bool, dry_run: bool,
+              config_paths: List[Path]) -> None:
+    """Get OS and app preferences, writing them to existing config files."""
     if len(config_paths) == 0:
         raise ValueError("Specify one or more config files.")
-    file_format = FileFormat[format]
-    for config_path in config_paths:
-        if dry_run:
-            diff_text = (
-                Sections
-                .from_config_file(path = config_path, file_format = file_format)
-                .diff_with_os(os_is_base = False, all_keys = all_keys))
-            if len(diff_text) > 0:
-                print("\n" + config_path.as_posix() + ":")
-                print("  " + diff_text.replace("\n", "\n  "))
-        else:
-            (Sections
-             .from_config_file(path = config_path, file_format = file_format)
+    file_format = FILE_FORMATS[format]
+    if dry_run:
+
+        def diff_config(config_path: Path) -> Optional[str]:
+            return (load_config(config_path, file_format)
+                    .diff_with_os(os_is_base = False, all_keys = all_keys))
+
+        for config_path, diff_text in zip(
+                config_paths, map_config_paths(diff_config, config_paths)):
+            print_diff(config_path, diff_text)
+    else:
+        # Config files are written serially, stopping at the first failure.
+        for config_path in config_paths:
+            (load_config(config_path, file_format)
              .merge_from_os(all_keys = all_keys)
              .to_config_file(config_path, file_format = file_format))
 
 
-@click.group()
-def dotmacos() -> None:
-    """Manage Mac OS and app preferences using config files."""
-    pass
+def load_config(config_path: Path, file_format: FileFormat) -> Sections:
+    """Read a config file, reusing the result if the same unmodified file was
+    already read."""
+    path = str(config_path)
+    return _load_config(path, file_format, os.stat(path).st_mtime_ns)
 
 
-dotmacos.add_command(help)
-dotmacos.add_command(set)
-dotmacos.add_command(get)
+@functools.lru_cache(maxsize = 32)
+def _load_config(path: str, file_format: FileFormat, mtime_ns: int,
+                 ) -> Sections:
+    """Read a config file. mtime_ns is only used as part of the cache key."""
+    return Sections.from_config_file(Path(path), file_format = file_format)
+
+
+def map_config_paths(func: Callable[[Path], T], config_paths: List[Path],
+                     ) -> Iterator[T]:
+    """Apply func to config files concurrently, yielding results in order.
+    Threads suffice since the work is mostly waiting on `defaults`
+    subprocesses, whose total number is capped by preflib. On the first
+    error, files not yet started are skipped. func should not write files, as
+    those already started are not stopped."""
+    executor = ThreadPoolExecutor(max_workers = min(8, len(config_paths)))
+    futures = [executor.submit(func, config_path)
+               for config_path in config_paths]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown()
+
+
+def print_diff(config_path: Path, diff_text: Optional[str]) -> None:
+    """Print the differences between a config file and the OS, if any."""
+    if diff_text:
+        sys.stdout.write("\n{path}:\n{diff}\n".format(
+            path = config_path,
+            diff = textwrap.indent(diff_text, "  ")))
+
+
+def parse_args(args: List[str]) -> Optional[Callable[[], None]]:
+    """Parse the command line of a set or get command without importing click,
+    which dominates the startup time of this utility. Return None if the
+    command line needs click e.g. for --help, shell completion or to report
+    invalid usage."""
+    if (len(args) == 0 or args[0] not in FAST_COMMAND_FLAGS or
+            COMPLETION_ENV_VAR in os.environ):
+        return None
+    command, flags = args[0], FAST_COMMAND_FLAGS[args[0]]
+    kwargs: Dict[str, Any] = {name: False for name in flags.values()}
+    format: Optional[str] = None
+    config_paths: List[Path] = []
+    remaining_args = iter(args[1:])
+    for arg in remaining_args:
+        if arg == "--format":
+            format = next(remaining_args, None)
+        elif arg.startswith("--format="):
+            format = arg[len("--format="):]
+        elif arg in flags:
+            kwargs[flags[arg]] = True
+        elif arg.startswith("-"):
+            return None
+        else:
+            config_paths.append(Path(arg))
+    if format not in CONFIG_FORMATS:
+        return None
+    kwargs.update(format = format, config_paths = config_paths)
+    run: Callable[..., None] = set_prefs if command == "set" else get_prefs
+    return functools.partial(run, **kwargs)
 
 
 def main() -> None:
     """This function is called by executable scripts. It calls the main CLI
     dispatcher and handles uncaught exceptions."""
     try:
-        dotmacos()
+        run = parse_args(sys.argv[1:])
+        if run is None:
+            from .commands import dotmacos
+            dotmacos()
+        else:
+            run()
     except SystemExit:  # Raised by sys.exit(), so pass it through.
         raise
     except BaseException as e:
@@ -124,18 +194,34 @@ def error(status: int, message: str = "",
     """Print a formatted message and/or exception to stderr and exit."""
     text = "\n".join([message.strip(), str(exception).strip()]).strip()
     if len(text) > 0:
-        sys.stderr.write("{marker}{text}\n".format(
-            marker = "\033[31mE\033[0m " if sys.stderr.isatty() else "E ",
-            text = text.replace("\n", "\n  ")))
+        write_stderr(ERROR_MARKER, text)
     sys.exit(status)
 
 
 def info(message: str) -> None:
     """Print a formatted message to stderr."""
     if len(message) > 0:
-        sys.stderr.write("{marker}{text}\n".format(
-            marker = "  ",
-            text = message.strip().replace("\n", "\n  ")))
+        write_stderr(INFO_MARKER, message.strip())
+
+
+def write_stderr(marker: bytes, text: str) -> None:
+    """Write marked and indented text to stderr, bypassing the text layer if
+    stderr has a binary buffer. Text already written to stderr is flushed
+    first, to keep output in order."""
+    if sys.stderr is None:
+        return
+    text = text.replace("\n", "\n  ")
+    sys.stderr.flush()
+    buffer = getattr(sys.stderr, "buffer", None)
+    if buffer is None:
+        sys.stderr.write(marker.decode() + text + "\n")
+        sys.stderr.flush()
+    else:
+        encoding = getattr(sys.stderr, "encoding", None) or "utf-8"
+        buffer.write(marker +
+                     text.encode(encoding, errors = "backslashreplace") +
+                     b"\n")
+        buffer.flush()
 
 
 if __name__ == "__main__":
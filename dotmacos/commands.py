@@ -0,0 +1,71 @@
+import os
+from pathlib import Path
+from typing import List
+
+import click
+
+from .cli import (COMPLETION_ENV_VAR, CONFIG_FORMATS, get_prefs, set_prefs,
+                  show_manual)
+
+
+# Initialize shell completion support, but only when completing.
+if COMPLETION_ENV_VAR in os.environ:
+    import click_completion
+    click_completion.init()
+
+
+# Options and arguments shared by commands.
+format_option = click.option(
+    "--format", type = click.Choice(CONFIG_FORMATS), required = True,
+    help = "Format of config files.")
+dry_run_option = click.option(
+    "--dry-run", is_flag = True,
+    help = "Show what settings would be added or changed.")
+config_paths_argument = click.argument("config_paths", type = Path, nargs = -1)
+
+
+@click.command()
+def help() -> None:
+    """Show the manual."""
+    show_manual()
+
+
+@click.command()
+@format_option
+@click.option("--no-restart-apps", is_flag = True,
+              help = "Skip restarting affected applications. New preferences "
+                     "may not take effect.")
+@dry_run_option
+@config_paths_argument
+def set(format: str, no_restart_apps: bool, dry_run: bool,
+        config_paths: List[Path]) -> None:
+    """Set OS and app preferences from config files. Restart affected
+    applications to ensure that new preferences take effect immediately."""
+    set_prefs(format = format, no_restart_apps = no_restart_apps,
+              dry_run = dry_run, config_paths = config_paths)
+
+
+@click.command()
+@format_option
+@click.option("--all-keys", is_flag = True,
+              help = "Include keys not in the config files.")
+@dry_run_option
+@config_paths_argument
+def get(format: str, all_keys: bool, dry_run: bool, config_paths: List[Path],
+        ) -> None:
+    """Get OS and app preferences, writing them to existing config files. Only
+    keys in the config files are written, unless all_keys is True. Values are
+    merged, with retrieved preferences taking precedence."""
+    get_prefs(format = format, all_keys = all_keys, dry_run = dry_run,
+              config_paths = config_paths)
+
+
+@click.group()
+def dotmacos() -> None:
+    """Manage Mac OS and app preferences using config files."""
+    pass
+
+
+dotmacos.add_command(help)
+dotmacos.add_command(set)
+dotmacos.add_command(get)
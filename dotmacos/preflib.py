@@ -1,17 +1,19 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
 import enum
+import functools
 import datetime
-import numbers
+import glob
+import hashlib
+import json
 import os
 from pathlib import Path
-import plistlib
 from pprint import pformat
 import subprocess
 import tempfile
-from typing import (Any, ByteString, cast, Container, Dict, FrozenSet, Optional,
-                    Sequence)
-import xml.parsers.expat as expat
-
-import pyjson5
+import threading
+from typing import (Any, cast, Container, Dict, FrozenSet, List, Optional, Set,
+                    Tuple)
 
 
 class FileFormat(enum.Enum):
@@ -24,6 +26,50 @@ class FileFormat(enum.Enum):
 ALL_SECTIONS: FrozenSet[str] = frozenset(["user", "local", "system"])
 ACCESSIBLE_SECTIONS: FrozenSet[str] = frozenset(
     ["system"] if IS_ROOT_USER else ["user", "local"])
+# Concrete types of scalar plist values, which are faster to check against
+# than the numbers.Real and ByteString ABCs.
+PLIST_SCALAR_TYPES = (bool, int, float, datetime.datetime, str, bytes,
+                      bytearray)
+PLIST_SCALAR_TYPE_SET: FrozenSet[type] = frozenset(PLIST_SCALAR_TYPES)
+BINARY_PLIST_MAGIC = b"bplist00"
+# Default for dict.get() that cannot be a preference value.
+MISSING = object()
+# All preferences in each (section, domain) exported from the OS in this run.
+OS_KEYVALUE_CACHE: Dict[Tuple[str, str], Dict[str, Any]] = {}
+# Each (section, domain) written in this run, whose plist cfprefsd may not have
+# saved yet.
+OS_WRITTEN_DOMAINS: Set[Tuple[str, str]] = set()
+# Most domains exported at once, across all threads, e.g. when several config
+# files are read concurrently.
+MAX_CONCURRENT_EXPORTS = 8
+EXPORT_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_EXPORTS)
+# Names accepted by `defaults` for the global domain.
+GLOBAL_DOMAIN_NAMES: FrozenSet[str] = frozenset(
+    ["NSGlobalDomain", "-g", "-globalDomain"])
+
+
+@functools.lru_cache(maxsize = 1)
+def core_foundation() -> Any:
+    """The CoreFoundation module of PyObjC, or None if it is not installed.
+    If available, it is used to access preferences via cfprefsd directly,
+    instead of running `defaults` and exchanging plist files with it."""
+    try:
+        import CoreFoundation
+    except ImportError:
+        return None
+    return CoreFoundation
+
+
+@functools.lru_cache(maxsize = 1)
+def lxml_etree() -> Any:
+    """The etree module of lxml, or None if it is not installed. If available,
+    it is used to parse XML plists exported by `defaults`, which is faster than
+    plistlib's expat-based parser."""
+    try:
+        from lxml import etree
+    except ImportError:
+        return None
+    return etree
 
 
 class Prefs(Dict):
@@ -32,19 +78,28 @@ def __new__(cls, mapping: Dict[str, Any]) -> "Prefs":
         # Check that mapping is a dictionary.
         if not isinstance(mapping, dict):
             raise ValueError("Invalid prefs: not a mapping.")
-        # Check keys are valid pref keys.
-        if not all(isinstance(key, str) for key in mapping):
-            raise ValueError("Invalid preference keys: {}".format(
-                ", ".join(key for key in mapping
-                          if not isinstance(key, str))))
-        # Check values are valid pref values.
-        if not all(cls._is_valid_value(value) for value in mapping.values()):
+        # Check keys and values are valid pref keys and values in one pass,
+        # and find the invalid ones only to report them.
+        if not all(isinstance(key, str) and cls._is_valid_value(value)
+                   for key, value in mapping.items()):
+            if not all(isinstance(key, str) for key in mapping):
+                raise ValueError("Invalid preference keys: {}".format(
+                    ", ".join(str(key) for key in mapping
+                              if not isinstance(key, str))))
             raise ValueError("Invalid preference values:\n{}".format(
                 "\n".join(pformat(value) for value in mapping.values()
                           if not cls._is_valid_value(value))))
         self = dict.__new__(cls, mapping)
         return cast(Prefs, self)
 
+    @classmethod
+    def _trusted(cls, mapping: Dict[str, Any]) -> "Prefs":
+        """Create a Prefs object without validating mapping, which must be
+        known to be valid, e.g. because it was parsed from a plist."""
+        self = dict.__new__(cls)
+        self.update(mapping)
+        return self
+
     @staticmethod
     def merge(*, old: "Prefs", new: "Prefs") -> "Prefs":
         """Merge two Prefs dictionaries. Values in `new` take precedence.
@@ -59,56 +114,149 @@ def merge(*, old: "Prefs", new: "Prefs") -> "Prefs":
         dict O     dict N     dict M (union of keys; dict N values preferred)
         <other>    dict N     dict N
         """
-        result = dict(old)
+        # Both arguments are valid, so the result need not be validated.
+        if len(new) == 0:
+            return Prefs._trusted(old)
+        if len(old) == 0:
+            return Prefs._trusted(new)
+        result = {**old}
         for new_key, new_value in new.items():
-            if (new_key in old and
-                    isinstance(new_value, dict) and
-                    isinstance(old[new_key], dict)):
-                # Merge dictionaries with new values taking precedence.
-                result[new_key] = dict(old[new_key])
-                result[new_key].update(new_value)
+            old_value = result.get(new_key)
+            if type(new_value) is dict and type(old_value) is dict:
+                # Merge dictionaries with new values taking precedence. The
+                # old dictionary is shared with `old`, so it is not updated.
+                result[new_key] = {**old_value, **new_value}
             else:
                 # Replace old value with new one, even for arrays.
                 result[new_key] = new_value
-        return Prefs(result)
+        return Prefs._trusted(result)
+
+    @staticmethod
+    def is_same(a: Any, b: Any) -> bool:
+        """True if two plist values are equal and of the same types. Unlike
+        ==, this distinguishes e.g. True from 1 and 1.0 from 1."""
+        if type(a) is not type(b):
+            return False
+        elif isinstance(a, dict):
+            return (a.keys() == b.keys() and
+                    all(Prefs.is_same(value, b[key])
+                        for key, value in a.items()))
+        elif isinstance(a, (list, tuple)):
+            return (len(a) == len(b) and
+                    all(Prefs.is_same(x, y) for x, y in zip(a, b)))
+        else:
+            return cast(bool, a == b)
 
     @staticmethod
     def diff_types(*, old: "Prefs", new: "Prefs") -> str:
-        shared_keys = set(new.keys()).intersection(set(old.keys()))
-        diff_types = [(key, type(old[key]), type(new[key]))
-                      for key in shared_keys
-                      if not isinstance(new[key], type(old[key]))]
-        return "\n".join(["{key}: {old} -> {new}".format(key = key,
-                                                         old = str(old_type),
-                                                         new = str(new_type))
-                          for key, old_type, new_type in diff_types])
+        lines = []
+        for key, new_value in new.items():
+            old_value = old.get(key, MISSING)
+            if (old_value is not MISSING and
+                    not isinstance(new_value, type(old_value))):
+                lines.append(f"{key}: {type(old_value)} -> {type(new_value)}")
+        return "\n".join(lines)
 
     @staticmethod
     def diff(*, old: "Prefs", new: "Prefs") -> str:
-        adds = ["<absent> -> {key}: {value}".format(key = key, value = value)
-                for key, value in new.items()
-                if key not in old]
-        modifs = [("{key}: {old} -> {new}"
-                   .format(key = key, old = str(old[key]), new = value)
-                   if isinstance(value, type(old[key])) else
-                   "{key}: ({old_type}) {old} -> ({new_type}) {new}"
-                   .format(key = key, old = str(old[key]), new = value,
-                           old_type = type(old[key]).__name__,
-                           new_type = type(value).__name__))
-                  for key, value in new.items()
-                  if key in old and value != old[key]]
+        # Report additions before modifications, in one walk over new.
+        adds = []
+        modifs = []
+        for key, value in new.items():
+            old_value = old.get(key, MISSING)
+            if old_value is MISSING:
+                adds.append(f"<absent> -> {key}: {value}")
+            elif value != old_value:
+                modifs.append(
+                    f"{key}: {old_value} -> {value}"
+                    if isinstance(value, type(old_value)) else
+                    f"{key}: ({type(old_value).__name__}) {old_value} -> "
+                    f"({type(value).__name__}) {value}")
         return "\n".join(adds + modifs)
 
     @classmethod
     def from_os(cls, *, section: str, domain: str,
-                keys: Optional[Container[str]] = None) -> "Prefs":
-        if not cls._is_accessible(section):
+                keys: Optional[Container[str]] = None,
+                allow_skip: bool = False) -> "Prefs":
+        """Get the current preferences in a domain, only those with the given
+        keys if any. If allow_skip is True, a domain that appears to have no
+        plist is assumed to be empty instead of being exported. Since that may
+        be wrong, it must only be used for output that is displayed, e.g. a
+        dry-run diff, and never for preferences written to the OS or to a
+        config file."""
+        if section not in ACCESSIBLE_SECTIONS:
             raise Exception("Cannot access {section} settings as user {uid}"
                             .format(section = section, uid = os.geteuid()))
-        plist_fd, plist_name = tempfile.mkstemp(suffix = ".plist")
+        # Each domain is exported at most once per run, unless it is written.
+        keyvalue = OS_KEYVALUE_CACHE.get((section, domain))
+        if keyvalue is None:
+            if (allow_skip and core_foundation() is None and
+                    not cls._may_have_plist(section = section,
+                                            domain = domain)):
+                # Skip starting `defaults` to export a domain that has no
+                # plist. This is not cached, so a later write still exports.
+                keyvalue = {}
+            else:
+                keyvalue = cls._export(section = section, domain = domain)
+                OS_KEYVALUE_CACHE[section, domain] = keyvalue
+        # Exported preferences are parsed from a plist, so they are valid.
+        if keys is None:
+            prefs = Prefs._trusted(keyvalue)
+        else:
+            # Keep the exported order of keys, so that diffs are consistent.
+            prefs = Prefs._trusted({key: value
+                                    for key, value in keyvalue.items()
+                                    if key in keys})
+        return prefs
+
+    @staticmethod
+    def _export(*, section: str, domain: str) -> Dict[str, Any]:
+        """Export all the preferences in a domain."""
+        cf = core_foundation()
+        with EXPORT_SLOTS:
+            if cf is None:
+                return Prefs._export_with_defaults(section = section,
+                                                   domain = domain)
+            else:
+                return Prefs._export_with_cf(cf, section = section,
+                                             domain = domain)
+
+    @staticmethod
+    def _may_have_plist(*, section: str, domain: str) -> bool:
+        """False if a user or local domain has no plist file in any location
+        that `defaults` reads for it, i.e. it has no preferences. True if it
+        may have one, including for other sections, for domains that are not
+        plain application IDs, whose files are not looked for, and for domains
+        written in this run."""
+        if (section not in ("user", "local") or domain in GLOBAL_DOMAIN_NAMES or
+                "/" in domain or domain.startswith((".", "-")) or
+                (section, domain) in OS_WRITTEN_DOMAINS):
+            return True
+        home = Path.home()
+        # The user's library, and those of sandboxed apps and app groups.
+        libraries = [
+            home / "Library",
+            home / "Library" / "Containers" / domain / "Data" / "Library",
+            home / "Library" / "Group Containers" / domain / "Library",
+        ]
+        prefs_dirs = [library / "Preferences" for library in libraries]
+        if section == "user":
+            return any((prefs_dir / (domain + ".plist")).exists()
+                       for prefs_dir in prefs_dirs)
+        else:
+            # ByHost plists are named <domain>.<host UUID>.plist.
+            pattern = glob.escape(domain) + ".*.plist"
+            return any(any((prefs_dir / "ByHost").glob(pattern))
+                       for prefs_dir in prefs_dirs)
+
+    @staticmethod
+    def _export_with_defaults(*, section: str, domain: str) -> Dict[str, Any]:
+        """Export all the preferences in a domain using `defaults`."""
+        import plistlib
+        import xml.parsers.expat as expat
         cmd = (["defaults"] +
                (["-currentHost"] if section == "local" else []) +
-               ["export", domain, plist_name])
+               ["export", domain, "-"])
         export_proc = subprocess.run(
             cmd,
             stdin = subprocess.DEVNULL,
@@ -122,77 +270,183 @@ def from_os(cls, *, section: str, domain: str,
                 .format(section = section, domain = domain,
                         cmd = " ".join(cmd),
                         status = export_proc.returncode,
-                        stdout = export_proc.stdout.decode(),
-                        stderr = export_proc.stderr.decode()))
+                        stdout = export_proc.stdout.decode(errors = "replace"),
+                        stderr = export_proc.stderr.decode(errors = "replace")))
+        plist_data = export_proc.stdout
+        # Specify the format to skip plistlib's detection.
+        plist_format = (plistlib.FMT_BINARY
+                        if plist_data.startswith(BINARY_PLIST_MAGIC) else
+                        plistlib.FMT_XML)
+        etree = lxml_etree()
         try:
-            with open(plist_name, "rb") as plist_file:
-                keyvalue: Dict[str, Any] = plistlib.load(
-                    plist_file, use_builtin_types = True)
-        except FileNotFoundError:
-            raise Exception("Internal error reading exported settings.")
-        except (plistlib.InvalidFileException,  # type: ignore
-                expat.ExpatError) as e:
+            keyvalue: Dict[str, Any]
+            if plist_format == plistlib.FMT_XML and etree is not None:
+                keyvalue = Prefs._loads_xml_plist(etree, plist_data)
+            else:
+                keyvalue = plistlib.loads(plist_data, fmt = plist_format)
+        except (ValueError, SyntaxError, expat.ExpatError) as e:
             raise Exception("Internal error parsing exported settings.")
-        os.close(plist_fd)
-        os.remove(plist_name)
-        if keys is None:
-            prefs = Prefs(keyvalue)
-        else:
-            prefs = Prefs({key: value
-                           for key, value in keyvalue.items()
-                           if key in keys})
-        return prefs
+        return keyvalue
+
+    @staticmethod
+    def _loads_xml_plist(etree: Any, plist_data: bytes) -> Dict[str, Any]:
+        """Parse an XML plist using lxml. Raise ValueError if it is invalid."""
+        parser = etree.XMLParser(remove_comments = True,
+                                 resolve_entities = False, no_network = True)
+        plist = etree.fromstring(plist_data, parser)
+        if plist.tag != "plist" or len(plist) != 1 or plist[0].tag != "dict":
+            raise ValueError("Invalid plist: root is not a dict.")
+        return cast(Dict[str, Any], Prefs._xml_plist_value(plist[0]))
+
+    @staticmethod
+    def _xml_plist_value(element: Any) -> Any:
+        """Convert a plist XML element to the value plistlib would return."""
+        tag = element.tag
+        text = element.text or ""
+        if tag == "dict":
+            if len(element) % 2 != 0:
+                raise ValueError("Invalid plist: dict key has no value.")
+            if any(key.tag != "key" for key in element[::2]):
+                raise ValueError("Invalid plist: dict key is not a <key>.")
+            return {key.text or "": Prefs._xml_plist_value(value)
+                    for key, value in zip(element[::2], element[1::2])}
+        elif tag == "array":
+            return [Prefs._xml_plist_value(item) for item in element]
+        elif tag == "string":
+            return text
+        elif tag == "integer":
+            return (int(text, 16) if text.startswith(("0x", "0X")) else
+                    int(text))
+        elif tag == "real":
+            return float(text)
+        elif tag == "true":
+            return True
+        elif tag == "false":
+            return False
+        elif tag == "date":
+            return datetime.datetime.strptime(text, "%Y-%m-%dT%H:%M:%SZ")
+        elif tag == "data":
+            return base64.b64decode(text)
+        raise ValueError("Invalid plist: unknown element <{}>.".format(tag))
+
+    @staticmethod
+    def _export_with_cf(cf: Any, *, section: str, domain: str,
+                        ) -> Dict[str, Any]:
+        """Export all the preferences in a domain using the CFPreferences API.
+        The preferences are converted to Python types via a binary plist."""
+        import plistlib
+        application, user, host = Prefs._cf_domain(cf, section, domain)
+        keys = cf.CFPreferencesCopyKeyList(application, user, host)
+        if keys is None:  # The domain has no preferences.
+            return {}
+        values = cf.CFPreferencesCopyMultiple(keys, application, user, host)
+        plist_data, error = cf.CFPropertyListCreateData(
+            None, values, cf.kCFPropertyListBinaryFormat_v1_0, 0, None)
+        if plist_data is None:
+            raise OSError(
+                "Failed to read current {section} settings for {domain}: "
+                "{error}".format(section = section, domain = domain,
+                                 error = error))
+        return cast(Dict[str, Any],
+                    plistlib.loads(bytes(plist_data),
+                                   fmt = plistlib.FMT_BINARY))
 
     def to_os(self, *, section: str, domain: str) -> None:
-        if not self._is_accessible(section):
+        if section not in ACCESSIBLE_SECTIONS:
             raise Exception("Cannot access {section} settings as user {uid}"
                             .format(section = section, uid = os.geteuid()))
-        with tempfile.NamedTemporaryFile("wb", suffix = ".plist") as plist_file:
-            try:
-                plistlib.dump(self, plist_file, fmt = plistlib.FMT_BINARY)
-            except (FileNotFoundError, PermissionError,
-                    TypeError, OverflowError) as e:
-                raise Exception("Internal error writing settings: " + str(e))
-            plist_file.flush()
-            os.sync()
-            cmd = (["defaults"] +
-                   (["-currentHost"] if section == "local" else []) +
-                   ["import", domain, plist_file.name])
-            import_proc = subprocess.run(
-                cmd,
-                stdin = subprocess.DEVNULL,
-                stdout = subprocess.PIPE,
-                stderr = subprocess.PIPE)
-            if import_proc.returncode != 0 or len(import_proc.stderr) > 0:
-                raise OSError(
-                    "Failed to write new {section} settings for {domain}: "
-                    "'{cmd}' exited with status {status}, stdout '{stdout}' "
-                    "and stderr '{stderr}'"
-                    .format(section = section, domain = domain,
-                            cmd = " ".join(cmd),
-                            status = import_proc.returncode,
-                            stdout = import_proc.stdout,
-                            stderr = import_proc.stderr))
+        import plistlib
+        try:
+            plist_data = plistlib.dumps(self, fmt = plistlib.FMT_BINARY)
+        except (TypeError, OverflowError) as e:
+            raise Exception("Internal error writing settings: " + str(e))
+        cf = core_foundation()
+        try:
+            if cf is None:
+                self._import_with_defaults(plist_data, section = section,
+                                           domain = domain)
+            else:
+                self._import_with_cf(cf, plist_data, section = section,
+                                     domain = domain)
+        finally:
+            OS_KEYVALUE_CACHE.pop((section, domain), None)
+            OS_WRITTEN_DOMAINS.add((section, domain))
 
-    @classmethod
-    def _is_valid_value(cls, value: Any) -> bool:
+    @staticmethod
+    def _import_with_defaults(plist_data: bytes, *, section: str, domain: str,
+                              ) -> None:
+        """Import preferences from a plist into a domain using `defaults`."""
+        cmd = (["defaults"] +
+               (["-currentHost"] if section == "local" else []) +
+               ["import", domain, "-"])
+        import_proc = subprocess.run(
+            cmd,
+            input = plist_data,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.PIPE)
+        if import_proc.returncode != 0 or len(import_proc.stderr) > 0:
+            raise OSError(
+                "Failed to write new {section} settings for {domain}: "
+                "'{cmd}' exited with status {status}, stdout '{stdout}' "
+                "and stderr '{stderr}'"
+                .format(section = section, domain = domain,
+                        cmd = " ".join(cmd),
+                        status = import_proc.returncode,
+                        stdout = import_proc.stdout.decode(errors = "replace"),
+                        stderr = import_proc.stderr.decode(errors = "replace")))
+
+    @staticmethod
+    def _import_with_cf(cf: Any, plist_data: bytes, *, section: str,
+                        domain: str) -> None:
+        """Import preferences from a plist into a domain using the
+        CFPreferences API."""
+        values, _, error = cf.CFPropertyListCreateWithData(
+            None, plist_data, cf.kCFPropertyListImmutable, None, None)
+        if values is None:
+            raise Exception("Internal error writing settings: " + str(error))
+        application, user, host = Prefs._cf_domain(cf, section, domain)
+        cf.CFPreferencesSetMultiple(values, None, application, user, host)
+        if not cf.CFPreferencesSynchronize(application, user, host):
+            raise OSError(
+                "Failed to write new {section} settings for {domain}"
+                .format(section = section, domain = domain))
+
+    @staticmethod
+    def _cf_domain(cf: Any, section: str, domain: str) -> Tuple[Any, Any, Any]:
+        """CFPreferences application, user and host arguments equivalent to
+        `[sudo] defaults [-currentHost] <verb> <domain>`."""
+        application = (cf.kCFPreferencesAnyApplication
+                       if domain in GLOBAL_DOMAIN_NAMES else
+                       domain)
+        host = (cf.kCFPreferencesCurrentHost if section == "local" else
+                cf.kCFPreferencesAnyHost)
+        return application, cf.kCFPreferencesCurrentUser, host
+
+    @staticmethod
+    def _is_valid_value(value: Any) -> bool:
         """True if value is a valid plist value. See
         https://en.wikipedia.org/wiki/Property_list#Mac_OS_X."""
-        if isinstance(value, (bool, numbers.Real, datetime.datetime, str,
-                              ByteString)):
+        # Most values are scalars, whose exact type can be looked up directly.
+        if type(value) in PLIST_SCALAR_TYPE_SET:
             return True
-        elif isinstance(value, Sequence):
-            return all(cls._is_valid_value(x) for x in value)
-        elif isinstance(value, Dict):
-            return all((isinstance(k, str) and cls._is_valid_value(v))
-                       for k, v in value.items())
-        else:
-            return False
-
-    @staticmethod
-    def _is_accessible(section: str) -> bool:
-        return ((section in ["user", "local"] and not IS_ROOT_USER) or
-                (section in ["system"] and IS_ROOT_USER))
+        # Walk nested values with a stack rather than by recursion. Look up
+        # exact scalar types first, then allow subclasses.
+        pending = [value]
+        while len(pending) > 0:
+            value = pending.pop()
+            if type(value) in PLIST_SCALAR_TYPE_SET:
+                continue
+            elif isinstance(value, dict):
+                if not all(isinstance(k, str) for k in value):
+                    return False
+                pending.extend(value.values())
+            elif isinstance(value, (list, tuple)):
+                pending.extend(value)
+            elif isinstance(value, PLIST_SCALAR_TYPES):
+                continue
+            else:
+                return False
+        return True
 
 
 class Domains(Dict):
@@ -201,17 +455,28 @@ def __new__(cls, mapping: Dict[str, Any]) -> "Domains":
         # Check that mapping is a dictionary.
         if not isinstance(mapping, dict):
             raise ValueError("Invalid domains: not a mapping.")
-        # Check keys are valid domain names.
-        if not all(isinstance(key, str) for key in mapping):
+        # Check keys are valid domain names and values are valid Prefs objects
+        # in one pass. Once an invalid name is found, only collect the rest.
+        bad_names: List[Any] = []
+        for domain, prefs in mapping.items():
+            if not isinstance(domain, str):
+                bad_names.append(domain)
+            elif not bad_names:
+                Prefs(prefs)
+        if bad_names:
             raise ValueError("Invalid domain names: {}".format(
-                ", ".join(key for key in mapping
-                          if not isinstance(key, str))))
-        # Check values are valid Prefs objects.
-        self = dict.__new__(
-            cls, {domain: Prefs(prefs)
-                  for domain, prefs in mapping.items()})
+                ", ".join(str(name) for name in bad_names)))
+        self = dict.__new__(cls, mapping)
         return cast(Domains, self)
 
+    @classmethod
+    def _trusted(cls, mapping: Dict[str, Any]) -> "Domains":
+        """Create a Domains object without validating mapping, which must be
+        known to be valid, e.g. because it was built from Prefs objects."""
+        self = dict.__new__(cls)
+        self.update(mapping)
+        return self
+
 
 class Sections(Dict):
 
@@ -219,73 +484,106 @@ def __new__(cls, mapping: Dict[str, Any]) -> "Sections":
         # Check that mapping is a dictionary.
         if not isinstance(mapping, dict):
             raise ValueError("Invalid sections: not a mapping.")
-        # Check keys are valid section names.
-        if not all(key in ALL_SECTIONS for key in mapping):
+        # Check keys are valid section names and values are valid Domains
+        # objects in one pass. Once an invalid name is found, only collect the
+        # rest.
+        bad_names: List[Any] = []
+        for section, domains in mapping.items():
+            if section not in ALL_SECTIONS:
+                bad_names.append(section)
+            elif not bad_names:
+                Domains(domains)
+        if bad_names:
             raise ValueError("Invalid section names: {}".format(
-                ", ".join(key for key in mapping
-                          if key not in ALL_SECTIONS)))
-        # Check values are valid Domains objects.
-        self = dict.__new__(
-            cls, {section: Domains(domains)
-                  for section, domains in mapping.items()})
+                ", ".join(str(name) for name in bad_names)))
+        self = dict.__new__(cls, mapping)
         return cast(Sections, self)
 
-    def diff_with_os(self, os_is_base: bool, all_keys: bool = False) -> str:
-
-        def diff_domain(section: str, domain: str, prefs: Prefs) -> str:
-            if os_is_base:
-                diff = Prefs.diff(
-                    old = Prefs.from_os(section = section, domain = domain),
-                    new = prefs)
-            else:
-                diff = Prefs.diff(
-                    old = prefs,
-                    new = Prefs.from_os(
-                        section = section, domain = domain,
-                        keys = None if all_keys else prefs.keys()))
-            return ("{domain}:\n{diff}"
-                    .format(domain = domain,
-                            diff = "  " + diff.replace("\n", "\n  "))
-                    if len(diff) > 0 else
-                    "")
-
-        def diff_section(section: str, domains: Domains) -> str:
-            diff = "\n".join(filter(lambda e: len(e) > 0,
-                                    [diff_domain(section, domain, prefs)
-                                     for domain, prefs in domains.items()]))
-            return ("{section}:\n{diff}"
-                    .format(section = section,
-                            diff = "  " + diff.replace("\n", "\n  "))
-                    if len(diff) > 0 else
-                    "")
-
-        return "\n".join(filter(lambda e: len(e) > 0,
-                                [diff_section(section, domains)
-                                 for section, domains in self.items()
-                                 if section in ACCESSIBLE_SECTIONS]))
+    @classmethod
+    def _trusted(cls, mapping: Dict[str, Any]) -> "Sections":
+        """Create a Sections object without validating mapping, which must be
+        known to be valid, e.g. because it was built from Domains objects."""
+        self = dict.__new__(cls)
+        self.update(mapping)
+        return self
+
+    def diff_with_os(self, os_is_base: bool, all_keys: bool = False,
+                     ) -> Optional[str]:
+        """Describe the differences between these and the OS preferences, or
+        return None if there are none."""
+        os_prefs = self._prefs_from_os(all_keys = os_is_base or all_keys,
+                                       allow_skip = True)
+        # Collect indented lines and join them once, omitting sections and
+        # domains without differences.
+        lines: List[str] = []
+        for section, domains in self.items():
+            if section not in ACCESSIBLE_SECTIONS:
+                continue
+            section_lines: List[str] = []
+            for domain, prefs in domains.items():
+                if os_is_base:
+                    diff = Prefs.diff(old = os_prefs[section, domain],
+                                      new = prefs)
+                else:
+                    diff = Prefs.diff(old = prefs,
+                                      new = os_prefs[section, domain])
+                if len(diff) > 0:
+                    section_lines.append(f"  {domain}:")
+                    section_lines.extend("    " + line
+                                         for line in diff.split("\n"))
+            if len(section_lines) > 0:
+                lines.append(f"{section}:")
+                lines.extend(section_lines)
+        return "\n".join(lines) if len(lines) > 0 else None
+
+    def _prefs_from_os(self, all_keys: bool, allow_skip: bool = False,
+                       ) -> Dict[Tuple[str, str], Prefs]:
+        """Get the current OS preferences for each accessible domain, keyed by
+        section and domain. Only keys in these sections are included, unless
+        all_keys is True. See Prefs.from_os for allow_skip. The `defaults`
+        subprocesses are run concurrently."""
+        requests = [(section, domain, None if all_keys else prefs.keys())
+                    for section, domains in self.items()
+                    if section in ACCESSIBLE_SECTIONS
+                    for domain, prefs in domains.items()]
+        with ThreadPoolExecutor(
+                max_workers = MAX_CONCURRENT_EXPORTS) as executor:
+            results = executor.map(
+                lambda request: Prefs.from_os(section = request[0],
+                                              domain = request[1],
+                                              keys = request[2],
+                                              allow_skip = allow_skip),
+                requests)
+            return {(section, domain): prefs
+                    for (section, domain, _), prefs in zip(requests, results)}
 
     def merge_from_os(self, all_keys: bool = False) -> "Sections":
-        return Sections(
+        # Every domain is exported, as the result is written to a config file.
+        os_prefs = self._prefs_from_os(all_keys = all_keys)
+        # These sections and merged OS prefs are valid, so is the result.
+        return Sections._trusted(
             {section:
-                ({domain: Prefs.merge(
-                    old = prefs,
-                    new = Prefs.from_os(
-                        section = section,
-                        domain = domain,
-                        keys = None if all_keys else prefs.keys()))
-                  for domain, prefs in domains.items()}
+                (Domains._trusted(
+                    {domain: Prefs.merge(old = prefs,
+                                         new = os_prefs[section, domain])
+                     for domain, prefs in domains.items()})
                  if section in ACCESSIBLE_SECTIONS else
                  domains)
              for section, domains in self.items()})
 
     def merge_to_os(self) -> None:
+        # Read concurrently, but write one domain at a time. Skip domains that
+        # would not change, saving a `defaults import` or cfprefsd sync each.
+        # Every domain is exported, as wrongly taking one to be empty would
+        # drop its preferences that are not in the config.
+        os_prefs = self._prefs_from_os(all_keys = True)
         for section, domains in self.items():
             if section in ACCESSIBLE_SECTIONS:
                 for domain, prefs in domains.items():
-                    (Prefs.merge(old = Prefs.from_os(section = section,
-                                                     domain = domain),
-                                 new = prefs)
-                     .to_os(section = section, domain = domain))
+                    old_prefs = os_prefs[section, domain]
+                    new_prefs = Prefs.merge(old = old_prefs, new = prefs)
+                    if not Prefs.is_same(old_prefs, new_prefs):
+                        new_prefs.to_os(section = section, domain = domain)
 
     @classmethod
     def from_config_file(cls, path: Path, *, file_format: FileFormat,
@@ -305,26 +603,98 @@ def from_config_file(cls, path: Path, *, file_format: FileFormat,
 
     @classmethod
     def _read_json5(cls, path: Path) -> Dict[str, Any]:
-        with open(path.as_posix(), "rt") as file_handle:
-            data = pyjson5.load(file_handle)
+        text = path.read_bytes().decode("utf-8")
+        # Most JSON5 config files are also valid JSON, which the (C
+        # accelerated) json module parses much faster than pyjson5. Fall back
+        # to pyjson5 only for JSON5 syntax e.g. comments.
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            import pyjson5
+            data = pyjson5.loads(text)
         if cls._is_valid_data(data):
             return cast(Dict[str, Any], data)
         else:
             raise ValueError(
-                "Invalid data in config file {}".format(path.as_posix()))
+                "Invalid data in config file {}".format(path))
 
     @classmethod
     def _read_json(cls, path: Path) -> Dict[str, Any]:
-        raise NotImplementedError()
+        data = json.loads(path.read_bytes())
+        if cls._is_valid_data(data):
+            return cast(Dict[str, Any], data)
+        else:
+            raise ValueError(
+                "Invalid data in config file {}".format(path))
 
     @classmethod
     def _read_yaml(cls, path: Path) -> Dict[str, Any]:
-        raise NotImplementedError()
+        # Parsing YAML is slow even with libyaml, so the parsed data is cached
+        # as JSON, along with a hash of the config file's contents. Hashing is
+        # cheap compared to parsing, and unlike mtimes, which can go backwards
+        # (e.g. `cp -p`) or stay the same across quick edits, detects changes.
+        # The cache is not used by root, e.g. under `sudo`, which keeps $HOME:
+        # root would create a cache directory the user cannot write to, and
+        # read system preferences from a file the user can write to.
+        cache_path = cls._yaml_cache_path(path)
+        yaml_data = path.read_bytes()
+        source = hashlib.sha1(yaml_data).hexdigest()
+        if not IS_ROOT_USER:
+            try:
+                cache = json.loads(cache_path.read_bytes())
+                if (type(cache) is dict and cache.get("source") == source and
+                        cls._is_valid_data(cache.get("data"))):
+                    return cast(Dict[str, Any], cache["data"])
+            except (OSError, ValueError):
+                pass
+        import yaml
+        # Use libyaml, if PyYAML was built with it. It parses bytes directly,
+        # without decoding in Python.
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        data = yaml.load(yaml_data, Loader = loader)
+        if not cls._is_valid_data(data):
+            raise ValueError(
+                "Invalid data in config file {}".format(path))
+        # Only cache data that survives a round-trip through JSON unchanged.
+        # Nested keys must be strings, as json.dumps would silently convert
+        # others. Dates and binary data are valid plist values, but make
+        # json.dumps raise TypeError, so _write_yaml_cache skips them.
+        if not IS_ROOT_USER and Prefs._is_valid_value(data):
+            cls._write_yaml_cache(cache_path, {"source": source, "data": data})
+        return cast(Dict[str, Any], data)
+
+    @staticmethod
+    def _write_yaml_cache(cache_path: Path, cache: Dict[str, Any]) -> None:
+        """Atomically write a YAML cache entry, ignoring any errors. The
+        temporary file is removed if it cannot be written or renamed."""
+        temp_path: Optional[str] = None
+        try:
+            cache_text = json.dumps(cache)
+            cache_path.parent.mkdir(parents = True, exist_ok = True)
+            with tempfile.NamedTemporaryFile(
+                    "wt", dir = cache_path.parent,
+                    delete = False) as cache_handle:
+                temp_path = cache_handle.name
+                cache_handle.write(cache_text)
+            os.replace(temp_path, cache_path)
+        except (OSError, TypeError, ValueError):
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _yaml_cache_path(path: Path) -> Path:
+        """Path of the cached, parsed data of a YAML config file. The cache is
+        kept out of the config file's directory, which may be under SCM."""
+        key = hashlib.sha1(str(path.resolve()).encode()).hexdigest()
+        return Path.home() / "Library" / "Caches" / "dotmacos" / (key + ".json")
 
     @staticmethod
     def _is_valid_data(data: Any) -> bool:
-        return (isinstance(data, dict) and
-                all(isinstance(key, str) for key in data))
+        return (type(data) is dict and
+                not any(type(key) is not str for key in data))
 
     def to_config_file(self, path: Path, file_format: FileFormat) -> None:
         if file_format == FileFormat.json5:
@@ -338,7 +708,8 @@ def to_config_file(self, path: Path, file_format: FileFormat) -> None:
                 "Invalid config format: {}".format(file_format.name))
 
     def _write_json5(self, path: Path) -> None:
-        with open(path.as_posix(), "wt") as file_handle:
+        import pyjson5
+        with open(path, "wt") as file_handle:
             pyjson5.dump(self, file_handle)
 
     def _write_json(self, path: Path) -> None:
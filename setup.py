@@ -2,25 +2,23 @@
 from pathlib import Path
 import re
 from setuptools import setup
+from setuptools.command.build_py import build_py
 from typing import List
 
 
 PROJECT_NAME = "dotmacos"
+VERSION_RE = re.compile(r"__version__ = *[\"'](.+)[\"']")
 
 
 def get_version() -> str:
     info_path = Path(__file__).parent / PROJECT_NAME / "__init__.py"
     with open(info_path, "rt") as info_handle:
-        info = info_handle.read()
-    try:
-        version = (re.search(r"^__version__ = *[\"'](.+)[\"']",  # type: ignore
-                             info,
-                             re.MULTILINE)
-                   .group(1))
-    except Exception as e:
-        raise RuntimeError("Failed to parse version string from {path}"
-                           .format(path = info_path.as_posix()))
-    return version
+        for line in info_handle:
+            match = VERSION_RE.match(line)
+            if match is not None:
+                return match.group(1)
+    raise RuntimeError("Failed to parse version string from {path}"
+                       .format(path = info_path.as_posix()))
 
 
 def get_required_packages_from_pipfile() -> List[str]:
@@ -35,6 +33,21 @@ def get_required_packages_from_pipfile() -> List[str]:
             for k, v in config.items("packages")]
 
 
+class BuildPyWithManData(build_py):
+    """Snapshots the manual into a generated module, so that `dotmacos help`
+    does not need to locate and read man.txt at runtime.
+    """
+
+    def run(self) -> None:
+        super().run()
+        man_path = Path(__file__).parent / PROJECT_NAME / "man.txt"
+        with open(man_path.as_posix(), "rt") as man_handle:
+            man_text = man_handle.read()
+        module_path = Path(self.build_lib) / PROJECT_NAME / "_man_data.py"
+        with open(module_path.as_posix(), "wt") as module_handle:
+            module_handle.write("MAN_TEXT = {!r}\n".format(man_text))
+
+
 setup(
     name = PROJECT_NAME,
     version = get_version(),
@@ -45,6 +58,7 @@ def get_required_packages_from_pipfile() -> List[str]:
     package_data = {"dotmacos": ["man.txt"]},
     include_package_data = True,
     install_requires = get_required_packages_from_pipfile(),
+    cmdclass = {"build_py": BuildPyWithManData},
 
     # Generate entry-points (i.e. executable scripts) in the environment.
     entry_points = """